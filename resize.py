@@ -3,19 +3,33 @@
 # Needs: ffmpeg installed
 
 from argparse import ArgumentParser
-from dataclasses import dataclass
 from logging import INFO, basicConfig, error, info
 from math import ceil
-from os import path, popen
-from re import findall
-from tempfile import mktemp as mktempfile
+from os import close, cpu_count, path
+from re import compile as compile_regex
+from select import POLLIN, poll
+from subprocess import DEVNULL, STDOUT, Popen, run
+from tempfile import NamedTemporaryFile, TemporaryFile
 from time import time
+from typing import NamedTuple
+
+try:
+    from os import pidfd_open
+except ImportError:
+    pidfd_open = None
 
 basicConfig(format="[%(levelname)s] %(message)s", level=INFO)
 
+SIZE_PATTERN = compile_regex(r"\s*(\d+)\s*x\s*(\d+)\s*")
+# Milliseconds between checks on conversions that could not get a pidfd
+POLL_INTERVAL = 100
+
+
+class ConversionFailed(Exception):
+    pass
 
-@dataclass
-class Size:
+
+class Size(NamedTuple):
     width: int
     height: int
 
@@ -25,18 +39,23 @@ class Size:
 
 class AspectBasedSizeCalculator:
     aspect: float
+    inverse_aspect: float
 
     def __init__(self, original_size: Size):
         self.aspect = original_size.width / original_size.height
+        self.inverse_aspect = original_size.height / original_size.width
 
     def best_fit(self, target_size: Size) -> Size:
+        target_aspect = target_size.width / target_size.height
+        if abs(target_aspect - self.aspect) < 1e-9:
+            return target_size
         size = self.height_based(target_size.height)
         if size.width < target_size.width or size.height < target_size.height:
             size = self.width_based(target_size.width)
         return size
 
     def width_based(self, width: int) -> Size:
-        height = width / self.aspect
+        height = width * self.inverse_aspect
         size = Size(ceil(width), ceil(height))
         return size
 
@@ -47,38 +66,123 @@ class AspectBasedSizeCalculator:
 
 
 def parse_size(size: str) -> Size:
-    width, height = size.split("x")
-    size = Size(int(width), int(height))
-    return size
+    match = SIZE_PATTERN.fullmatch(size)
+    if not match:
+        raise ValueError(f"invalid size: {size}")
+    width, height = int(match[1]), int(match[2])
+    if width == 0 or height == 0:
+        raise ValueError(f"invalid size: {size}")
+    return Size(width, height)
 
 
 def get_original_size(file: str) -> Size:
-    proc = popen(f"file '{file}'")
-    if proc._proc.wait() != 0:
-        raise Exception("'file' program run into errors")
-    output = proc._proc.stdout.read()
-    sizes = findall(r"([0-9]*[ ]?x[ ]?[0-9]*)", output)
-    if not sizes:
-        raise Exception("'file' program don't showed any size")
-    return parse_size(sizes[-1])
-
-
-def convert(input_file: str, output_file: str, target_size: Size):
-    logfile = mktempfile()
-    proc = popen(
-        " ".join(
-            [
-                "ffmpeg -y",
-                f"-i '{input_file}'",
-                f"-s {target_size}",
-                f"'{output_file}'",
-                f"1>{logfile} 2>{logfile}",
-            ]
-        )
+    result = run(
+        [
+            "ffprobe",
+            "-v",
+            "error",
+            "-select_streams",
+            "v:0",
+            "-show_entries",
+            "stream=width,height",
+            "-of",
+            "csv=p=0:s=x",
+            file,
+        ],
+        capture_output=True,
+        text=True,
     )
-    if proc._proc.wait() != 0:
-        error(f"Failed to convert, ffmpeg log {logfile}")
-        exit(4)
+    if result.returncode != 0:
+        raise Exception(f"'ffprobe' program run into errors: {result.stderr.strip()}")
+    output = result.stdout.strip()
+    if not output:
+        raise Exception("'ffprobe' program don't showed any size")
+    return parse_size(output)
+
+
+def open_pidfd(pid: int) -> int | None:
+    # pidfds need Linux 5.3+, without them conversions are polled every POLL_INTERVAL
+    if pidfd_open is None:
+        return None
+    try:
+        return pidfd_open(pid)
+    except OSError:
+        return None
+
+
+class Conversion:
+    def __init__(self, input_file: str, output_file: str, scale: str):
+        self.input_file = input_file
+        self.log = TemporaryFile()
+        self.started_at = time()
+        try:
+            self.process = Popen(
+                [
+                    "ffmpeg",
+                    "-y",
+                    "-i",
+                    input_file,
+                    "-vf",
+                    f"scale={scale}",
+                    output_file,
+                ],
+                # Concurrent ffmpegs must not fight over the terminal
+                stdin=DEVNULL,
+                stdout=self.log,
+                stderr=STDOUT,
+            )
+        except OSError:
+            self.log.close()
+            raise
+        self.pidfd = open_pidfd(self.process.pid)
+
+    def exited(self, ready_pidfds: set[int]) -> bool:
+        if self.pidfd is None:
+            return self.process.poll() is not None
+        return self.pidfd in ready_pidfds
+
+    def finish(self) -> float:
+        if self.pidfd is not None:
+            close(self.pidfd)
+        code = self.process.wait()
+        finished_at = time()
+        if code != 0:
+            self.log.seek(0)
+            with NamedTemporaryFile(suffix=".log", delete=False) as log:
+                log.write(self.log.read())
+            self.log.close()
+            raise ConversionFailed(f"ffmpeg log {log.name}")
+        self.log.close()
+        return finished_at - self.started_at
+
+
+def finish(conversion: Conversion, change: str) -> int:
+    try:
+        elapsed = conversion.finish()
+    except ConversionFailed as e:
+        error(f"Failed to convert {conversion.input_file}, {e}")
+        return 4
+    info(
+        f"Converted {conversion.input_file} [{change}]"
+        f" with success in {elapsed:.2f} seconds."
+    )
+    return 0
+
+
+def get_scale(input_file: str, target_size: Size, exact: bool) -> tuple[str, str]:
+    if exact:
+        original_size = get_original_size(input_file)
+        output_size = AspectBasedSizeCalculator(original_size).best_fit(target_size)
+        scale = f"{output_size.width}:{output_size.height}"
+        change = f"{original_size} → {output_size}"
+    else:
+        # Let ffmpeg keep the aspect ratio itself, saving a ffprobe run
+        scale = (
+            f"{target_size.width}:{target_size.height}"
+            ":force_original_aspect_ratio=increase"
+        )
+        change = f"fit {target_size}"
+    return scale, change
 
 
 def parse_arguments():
@@ -86,9 +190,17 @@ def parse_arguments():
         description="Resize images keeping the original aspect ratio",
     )
     args.add_argument("size", help="wanted output size(i.e: 1080x720)")
-    args.add_argument("input", help="input image")
+    args.add_argument("input", nargs="+", help="input images")
+    args.add_argument(
+        "-o",
+        "--output",
+        help="output file, single input only [default: resized-{filename}]",
+    )
     args.add_argument(
-        "-o", "--output", help="output file [default: resized-{filename}]"
+        "-e",
+        "--exact",
+        action="store_true",
+        help="probe the original size and compute the output size before converting",
     )
     return args.parse_args()
 
@@ -100,21 +212,61 @@ def main():
     except ValueError:
         error("Invalid target size")
         exit(1)
-    if not path.isfile(arg.input):
-        error("Input file not found")
-        exit(2)
-    try:
-        original_size = get_original_size(arg.input)
-    except Exception as e:
-        error(f"Failed to get original size: {e}")
-        exit(3)
-    output_size = AspectBasedSizeCalculator(original_size).best_fit(target_size)
-    output_file = arg.output or ("resized-" + arg.input.split("/")[-1])
-    info(f"Converting {arg.input} [{original_size} → {output_size}]...")
-    started_at = time()
-    convert(arg.input, output_file, output_size)
-    finished_at = time()
-    info(f"Converted with success in {finished_at-started_at:.2f} seconds.")
+    if arg.output and len(arg.input) > 1:
+        error("Output file can only be set for a single input")
+        exit(1)
+    for input_file in arg.input:
+        if not path.isfile(input_file):
+            error(f"Input file not found: {input_file}")
+            exit(2)
+    tasks = []
+    outputs: dict[str, str] = {}
+    for input_file in arg.input:
+        output_file = arg.output or ("resized-" + input_file.split("/")[-1])
+        if path.abspath(output_file) in outputs:
+            other_input = outputs[path.abspath(output_file)]
+            error(
+                f"{other_input} and {input_file} would both be saved as {output_file}"
+            )
+            exit(1)
+        outputs[path.abspath(output_file)] = input_file
+        tasks.append((input_file, output_file))
+    code = 0
+    pending = list(reversed(tasks))
+    running: dict[Conversion, str] = {}
+    # Wait on pidfds of every running ffmpeg at once instead of one waitpid each
+    poller = poll()
+    workers = cpu_count() or 1
+    info(f"Converting {len(pending)} file(s)...")
+    while pending or running:
+        while pending and len(running) < workers:
+            input_file, output_file = pending.pop()
+            try:
+                scale, change = get_scale(input_file, target_size, arg.exact)
+            except Exception as e:
+                error(f"Failed to get original size of {input_file}: {e}")
+                code = 3
+                continue
+            try:
+                conversion = Conversion(input_file, output_file, scale)
+            except OSError as e:
+                error(f"Failed to convert {input_file}, {e}")
+                code = 4
+                continue
+            if conversion.pidfd is not None:
+                poller.register(conversion.pidfd, POLLIN)
+            running[conversion] = change
+        if not running:
+            break
+        polling = any(conversion.pidfd is None for conversion in running)
+        ready_pidfds = {
+            pidfd for pidfd, _ in poller.poll(POLL_INTERVAL if polling else None)
+        }
+        for conversion in [c for c in running if c.exited(ready_pidfds)]:
+            if conversion.pidfd is not None:
+                poller.unregister(conversion.pidfd)
+            code = finish(conversion, running.pop(conversion)) or code
+    exit(code)
 
 
 if __name__ == "__main__":
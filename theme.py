@@ -2,32 +2,123 @@
 # Utility to set XFCE theme
 
 import argparse
+import atexit
 import json
+import pickle
+import shlex
 import subprocess
-from os import environ, path
+from concurrent.futures import ThreadPoolExecutor
+from functools import cache
+from os import environ, makedirs, path, remove, stat
+from shutil import which
 from time import localtime, tzset
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 NOTIFY_TITLE = "Theme Manager"
 DEFAULT_ICON = "style"
 CONFIG_PATH = path.join(environ.get("HOME", "/root"), ".config/themes.json")
+ENABLED_PATH = path.join(environ.get("HOME", "/root"), ".config/themes-enabled.txt")
+CACHE_PATH = path.join(environ.get("HOME", "/root"), ".cache/themes.pkl")
+
+
+def config_stamp() -> tuple[int, int]:
+    status = stat(CONFIG_PATH)
+    return status.st_mtime_ns, status.st_size
+
+
+def load_config() -> dict:
+    """
+    Loads the configuration file, using a pickled copy of it while it is up to date.
+
+    :return: The decoded configuration.
+    :rtype: dict
+    """
+    try:
+        stamp, config = pickle.load(open(CACHE_PATH, "rb"))
+        if stamp == config_stamp():
+            return config
+    except Exception:
+        pass
+    try:
+        stamp = config_stamp()
+        if orjson:
+            config = orjson.loads(open(CONFIG_PATH, "rb").read())
+        else:
+            config = json.load(open(CONFIG_PATH))
+    except:
+        return {"themes": {}, "enabled": ""}
+    try:
+        makedirs(path.dirname(CACHE_PATH), exist_ok=True)
+        pickle.dump((stamp, config), open(CACHE_PATH, "wb"))
+    except OSError:
+        pass
+    return config
+
+
+config = load_config()
 try:
-    config = json.load(open(CONFIG_PATH))
-except:
-    config = {"themes": {}, "enabled": ""}
+    config["enabled"] = open(ENABLED_PATH).read().strip()
+except OSError:
+    pass
+_dirty = False
+
+
+@atexit.register
+def _flush():
+    if not _dirty:
+        return
+    if orjson:
+        open(CONFIG_PATH, "wb").write(orjson.dumps(config))
+    else:
+        json.dump(config, open(CONFIG_PATH, "w"), separators=(",", ":"))
+    try:
+        remove(CACHE_PATH)
+    except OSError:
+        pass
 
 
 class CommandFailed(Exception):
     pass
 
 
+notifications: list[subprocess.Popen] = []
+
+
+@atexit.register
+def _wait_notifications():
+    for process in notifications:
+        process.wait()
+
+
 def notify(message: str, icon: str = DEFAULT_ICON):
     print(f'[THEME] {message}')
-    subprocess.run(["notify-send", "-i", icon, NOTIFY_TITLE, message])
+    notifications.append(
+        subprocess.Popen(
+            ["notify-send", "-i", icon, NOTIFY_TITLE, message],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+    )
+
 
+@cache
+def find_program(name: str) -> str:
+    return which(name) or name
 
-def cmd_run(cmd: str) -> tuple[int, str]:
+
+def cmd_run(argv: list[str], input: str | None = None) -> tuple[int, str]:
+    # An absolute executable and close_fds=False let subprocess use posix_spawn
     process = subprocess.run(
-        cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        argv,
+        input=None if input is None else input.encode(),
+        executable=find_program(argv[0]),
+        close_fds=False,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
     )
     code = process.returncode
     stderr = process.stderr.decode().strip()
@@ -35,52 +126,41 @@ def cmd_run(cmd: str) -> tuple[int, str]:
     return code, (stdout if code == 0 else stderr).strip()
 
 
-def get_properties(channel: str) -> list:
-    """
-    Retrieves a list of properties from the specified channel using the xfconf-query command.
-
-    :param channel: a string representing the channel to retrieve properties from
-    :type channel: str
-    :return: a list of properties retrieved from the specified channel
-    :rtype: list
-    :raises ValueError: if the specified channel is not a valid channel
-    """
-    code, output = cmd_run(f"xfconf-query -c '{channel}' -l")
-    if code != 0:
-        raise ValueError(f"{channel} is not a valid channel")
-    return output.split("\n")
-
-
-def xfconf_get(channel: str, property: str) -> str:
+def xfconf_dump(channel: str) -> dict[str, str]:
     """
-    This function retrieves the value of a property from the given XFCE channel using the `xfconf-query` command.
+    Retrieves every property of the given XFCE channel with a single `xfconf-query` call.
 
-    :param channel: A string representing the XFCE channel to retrieve the property value from.
-    :param property: A string representing the name of the property to retrieve the value of.
-    :return: A string representing the value of the property.
+    :param channel: A string representing the XFCE channel to dump.
+    :return: A dictionary mapping each property name to its value.
     :raises: CommandFailed, if the `xfconf-query` command fails to execute.
     """
-    code, output = cmd_run(f"xfconf-query -c '{channel}' -p '{property}'")
+    code, output = cmd_run(["xfconf-query", "-c", channel, "-lv"])
     if code != 0:
         raise CommandFailed(f"xfconf-query command failed: {output}")
-    return output
+    properties = {}
+    for line in output.splitlines():
+        name, _, value = line.partition(" ")
+        properties[name] = value.strip()
+    return properties
 
 
-def xfconf_set(channel: str, property_name: str, value: str):
+def xfconf_set_many(settings: dict[str, dict[str, str]]):
     """
-    Sets the value of a property in the Xfce settings channel.
+    Sets properties of several Xfce settings channels with a single shell process.
 
-    :param channel: The name of the channel.
-    :type channel: str
-    :param property_name: The name of the property.
-    :type property_name: str
-    :param value: The new value of the property.
-    :type value: str
-    :raises CommandFailed: If the `xfconf-query` command fails.
+    :param settings: A dictionary mapping channel names to dictionaries of property names
+        and their new values.
+    :type settings: dict[str, dict[str, str]]
+    :raises CommandFailed: If any of the `xfconf-query` commands fails.
     """
-    code, output = cmd_run(
-        f"xfconf-query -c '{channel}' -p '{property_name}' -s '{value}'"
-    )
+    commands = [
+        shlex.join(["xfconf-query", "-c", channel, "-p", name, "-s", value])
+        for channel, properties in settings.items()
+        for name, value in properties.items()
+    ]
+    if not commands:
+        return
+    code, output = cmd_run(["sh"], "set -e\n" + "\n".join(commands))
     if code != 0:
         raise CommandFailed(f"xfconf-query command failed: {output}")
 
@@ -98,12 +178,23 @@ def set_theme(theme: dict):
 
     :return: None
     """
-    xfconf_set("xsettings", "/Net/ThemeName", theme["gtk"])
-    xfconf_set("xfwm4", "/general/theme", theme.get("xfwm", theme.get("gtk")))
-    xfconf_set("xsettings", "/Net/IconThemeName", theme["icons"])
-    xfconf_set("xsettings", "/Gtk/CursorThemeName", theme["cursor"])
-    for workspace, wallpaper in theme["wallpapers"].items():
-        xfconf_set("xfce4-desktop", workspace, wallpaper)
+    settings = {
+        "xsettings": {
+            "/Net/ThemeName": theme["gtk"],
+            "/Net/IconThemeName": theme["icons"],
+            "/Gtk/CursorThemeName": theme["cursor"],
+        },
+        "xfwm4": {"/general/theme": theme.get("xfwm", theme.get("gtk"))},
+        "xfce4-desktop": theme["wallpapers"],
+    }
+    settings = {channel: props for channel, props in settings.items() if props}
+    with ThreadPoolExecutor(max_workers=len(settings)) as executor:
+        currents = executor.map(xfconf_dump, settings)
+    changed = {
+        channel: {p: v for p, v in properties.items() if current.get(p) != v}
+        for (channel, properties), current in zip(settings.items(), currents)
+    }
+    xfconf_set_many(changed)
 
 
 def get_wallpapers() -> dict[str, str]:
@@ -114,22 +205,36 @@ def get_wallpapers() -> dict[str, str]:
              wallpaper path.
     :rtype: dict[str, str]
     """
-    properties = get_properties("xfce4-desktop")
-    workspaces = [p for p in properties if "/last-image" in p]
-    wallpapers = {}
-    for w in workspaces:
-        wallpapers[w] = xfconf_get("xfce4-desktop", w)
-    return wallpapers
+    properties = xfconf_dump("xfce4-desktop")
+    return {p: v for p, v in properties.items() if "/last-image" in p}
 
 
 def get_theme():
-    return {
-        "gtk": xfconf_get("xsettings", "/Net/ThemeName"),
-        "xfwm": xfconf_get("xfwm4", "/general/theme"),
-        "icons": xfconf_get("xsettings", "/Net/IconThemeName"),
-        "cursor": xfconf_get("xsettings", "/Gtk/CursorThemeName"),
-        "wallpapers": get_wallpapers(),
-    }
+    xsettings = xfconf_dump("xsettings")
+    xfwm = xfconf_dump("xfwm4")
+    try:
+        theme = {
+            "gtk": xsettings["/Net/ThemeName"],
+            "xfwm": xfwm["/general/theme"],
+            "icons": xsettings["/Net/IconThemeName"],
+            "cursor": xsettings["/Gtk/CursorThemeName"],
+        }
+    except KeyError as e:
+        raise CommandFailed(f"Property {e.args[0]} is not set")
+    theme["wallpapers"] = get_wallpapers()
+    return theme
+
+
+def set_enabled(name: str):
+    """
+    Marks the theme with the given name as enabled, writing only the small sidecar file.
+
+    :param name: The name of the enabled theme.
+    :type name: str
+    """
+    config["enabled"] = name
+    with open(ENABLED_PATH, "w") as f:
+        f.write(name)
 
 
 def save(name: str):
@@ -139,9 +244,10 @@ def save(name: str):
     :param name: A string representing the name of the theme.
     :type name: str
     """
+    global _dirty
     config["themes"][name] = get_theme()
-    config["enabled"] = name
-    json.dump(config, open(CONFIG_PATH, "w"), indent=2)
+    _dirty = True
+    set_enabled(name)
 
 
 def load(name: str):
@@ -164,8 +270,7 @@ def load(name: str):
         return
     notify(f'Loading "{name}" theme...')
     set_theme(theme)
-    config["enabled"] = name
-    json.dump(config, open(CONFIG_PATH, "w"), indent=2)
+    set_enabled(name)
 
 
 def main() -> int: